@@ -0,0 +1,277 @@
+import operator
+
+import numpy
+
+
+operators = {"add": operator.add, "mult": operator.mul, "sub": operator.sub, "div": operator.truediv}
+ufuncs = {"add": numpy.add, "mult": numpy.multiply, "sub": numpy.subtract, "div": numpy.true_divide}
+symbols = {"add": "+", "mult": "*", "sub": "-", "div": "/"}
+cumath_names = {"absolute": "fabs", "arcsin": "asin", "arccos": "acos", "arctan": "atan"}
+max_nodes = 64
+
+
+class Deferred:
+    __slots__ = ("op", "left", "right", "backend", "value", "nodes")
+
+    def __init__(self, op, left, right, backend):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.backend = backend
+        self.value = None
+        self.nodes = 1 + pending_nodes(left) + pending_nodes(right)
+
+    def force(self):
+        if self.value is None:
+            self.value = self.backend.fuse(self)
+            self.left = None
+            self.right = None
+        return self.value
+
+    def __array__(self, dtype=None, copy=None):
+        return numpy.asarray(self.backend.from_device(self.force()), dtype=dtype)
+
+    def __str__(self):
+        return str(self.force())
+
+    def __repr__(self):
+        return "Deferred(" + repr(self.force()) + ")"
+
+
+def force(val):
+    if isinstance(val, Deferred):
+        return val.force()
+    return val
+
+
+def pending_nodes(val):
+    if isinstance(val, Deferred) and val.value is None:
+        return val.nodes
+    return 0
+
+
+def walk(expr, leaf, combine):
+    values = []
+    stack = [(expr, False)]
+    while len(stack) > 0:
+        node, expanded = stack.pop()
+        if expanded:
+            right = values.pop()
+            left = values.pop()
+            values.append(combine(node, left, right))
+        elif isinstance(node, Deferred) and node.value is None:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+        else:
+            values.append(leaf(force(node)))
+    return values[0]
+
+
+def result_dtype(op, left, right):
+    return ufuncs[op](sample(left), sample(right)).dtype
+
+
+def sample(val):
+    if hasattr(val, "dtype") and hasattr(val, "shape"):
+        return numpy.zeros(1, dtype=val.dtype)
+    return val
+
+
+class ArrayBackend:
+    name = None
+
+    def owns(self, val):
+        raise NotImplementedError
+
+    def arange(self, start, stop, step):
+        raise NotImplementedError
+
+    def to_device(self, arr):
+        raise NotImplementedError
+
+    def from_device(self, arr):
+        raise NotImplementedError
+
+    def fuse(self, expr):
+        raise NotImplementedError
+
+    def apply(self, func, args):
+        host = [self.from_device(arg) if self.owns(arg) else arg for arg in args]
+        return self.to_device(func(*host))
+
+
+class NumpyBackend(ArrayBackend):
+    name = "numpy"
+
+    def owns(self, val):
+        return isinstance(val, numpy.ndarray)
+
+    def arange(self, start, stop, step):
+        return numpy.arange(start, stop, step)
+
+    def to_device(self, arr):
+        return numpy.asarray(arr)
+
+    def from_device(self, arr):
+        return numpy.asarray(arr)
+
+    def fuse(self, expr):
+        return walk(expr, self.operand, self.combine)[0]
+
+    def apply(self, func, args):
+        return func(*args)
+
+    def operand(self, val):
+        return val, False
+
+    def combine(self, node, left, right):
+        left, left_owned = left
+        right, right_owned = right
+        dtype = result_dtype(node.op, left, right)
+        shape = numpy.broadcast_shapes(numpy.shape(left), numpy.shape(right))
+        out = None
+        if left_owned and isinstance(left, numpy.ndarray) and left.dtype == dtype and left.shape == shape:
+            out = left
+        elif right_owned and isinstance(right, numpy.ndarray) and right.dtype == dtype and right.shape == shape:
+            out = right
+        return ufuncs[node.op](left, right, out=out), True
+
+
+class CudaBackend(ArrayBackend):
+    name = "cuda"
+
+    def __init__(self):
+        import pycuda.autoinit
+        import pycuda.cumath
+        import pycuda.gpuarray
+        import pycuda.elementwise
+        import pycuda.tools
+        self.gpuarray = pycuda.gpuarray
+        self.cumath = pycuda.cumath
+        self.elementwise = pycuda.elementwise
+        self.tools = pycuda.tools
+        self.kernels = {}
+
+    def owns(self, val):
+        return isinstance(val, self.gpuarray.GPUArray)
+
+    def arange(self, start, stop, step):
+        return self.gpuarray.arange(start, stop, step)
+
+    def to_device(self, arr):
+        return self.gpuarray.to_gpu(numpy.ascontiguousarray(arr))
+
+    def from_device(self, arr):
+        if isinstance(arr, numpy.ndarray):
+            return arr
+        return arr.get()
+
+    def fuse(self, expr):
+        leaves = []
+        body, dtype = walk(expr, lambda leaf: self.operand(leaf, leaves), self.combine)
+        dtype = dtype.dtype
+        params = [self.tools.dtype_to_ctype(dtype) + " *out"]
+        shape = None
+        for i in range(len(leaves)):
+            if self.owns(leaves[i]):
+                params.append(self.tools.dtype_to_ctype(leaves[i].dtype) + " *x" + str(i))
+                shape = leaves[i].shape
+            else:
+                leaves[i] = numpy.asarray(leaves[i])[()]
+                params.append(self.tools.dtype_to_ctype(leaves[i].dtype) + " x" + str(i))
+        signature = ", ".join(params)
+        if (signature, body) not in self.kernels:
+            self.kernels[signature, body] = self.elementwise.ElementwiseKernel(signature, "out[i] = " + body)
+        out = self.gpuarray.empty(shape, dtype)
+        self.kernels[signature, body](out, *leaves)
+        return out
+
+    def apply(self, func, args):
+        name = cumath_names.get(func.__name__, func.__name__)
+        if len(args) == 1 and self.owns(args[0]) and hasattr(self.cumath, name):
+            return getattr(self.cumath, name)(args[0])
+        return super().apply(func, args)
+
+    def operand(self, leaf, leaves):
+        name = "x" + str(len(leaves))
+        leaves.append(leaf)
+        if self.owns(leaf):
+            return name + "[i]", sample(leaf)
+        return name, sample(leaf)
+
+    def combine(self, node, left, right):
+        left, left_sample = left
+        right, right_sample = right
+        dtype = numpy.zeros(1, dtype=result_dtype(node.op, left_sample, right_sample))
+        if node.op == "div":
+            return "((double) " + left + " / " + right + ")", dtype
+        return "(" + left + " " + symbols[node.op] + " " + right + ")", dtype
+
+
+registry = {"numpy": NumpyBackend, "cuda": CudaBackend}
+loaded = {}
+selected = "auto"
+
+
+def register(name, factory):
+    registry[name] = factory
+
+
+def select(name):
+    global selected
+    if name != "auto" and name not in registry:
+        raise RuntimeError("Unknown array backend " + name)
+    selected = name
+
+
+def load(name):
+    if name not in loaded:
+        loaded[name] = registry[name]()
+    return loaded[name]
+
+
+def get():
+    global selected
+    if selected == "auto":
+        try:
+            load("cuda")
+            selected = "cuda"
+        except Exception:
+            selected = "numpy"
+    return load(selected)
+
+
+def owner(val):
+    if isinstance(val, Deferred):
+        return val.backend
+    if isinstance(val, numpy.ndarray):
+        return load("numpy")
+    for backend in loaded.values():
+        if backend.owns(val):
+            return backend
+    return None
+
+
+def binary(op, a, b):
+    backend = owner(a) or owner(b)
+    if backend is None:
+        return operators[op](a, b)
+    expr = Deferred(op, a, b, backend)
+    if expr.nodes >= max_nodes:
+        expr.force()
+    return expr
+
+
+def apply(func, *args):
+    args = [force(arg) for arg in args]
+    backend = None
+    for arg in args:
+        backend = backend or owner(arg)
+    if backend is None:
+        result = func(*args)
+    else:
+        result = backend.apply(func, args)
+    if isinstance(result, numpy.ndarray) and result.ndim == 0:
+        return result[()]
+    return result
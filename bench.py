@@ -0,0 +1,120 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import memo
+from core import Function, set_max_depth
+from main import Program, backends
+
+
+workload_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+
+def run_workload(path, backend):
+    program = Program(backend)
+    memo.clear()
+    memo.configure(on=True)
+    with open(path, "r") as file:
+        lines = file.readlines()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line in lines:
+            if not program.read_line(line):
+                break
+
+
+def count_calls(path, backend):
+    evaluate = Function.evaluate
+    calls = [0]
+
+    def counting(self, new_args, namespace):
+        calls[0] += 1
+        return evaluate(self, new_args, namespace)
+
+    Function.evaluate = counting
+    try:
+        run_workload(path, backend)
+    finally:
+        Function.evaluate = evaluate
+    return calls[0]
+
+
+def peak_memory(path, backend):
+    tracemalloc.start()
+    try:
+        run_workload(path, backend)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(path, backend, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_workload(path, backend)
+        times.append(time.perf_counter() - start)
+    wall = min(times)
+    calls = count_calls(path, backend)
+    return {"wall": wall, "calls": calls, "calls_per_sec": calls / wall if wall > 0 else 0.0,
+            "peak_bytes": peak_memory(path, backend)}
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results["workloads"].items():
+        if name not in baseline["workloads"]:
+            continue
+        before = baseline["workloads"][name]["wall"]
+        after = result["wall"]
+        change = (after - before) / before if before > 0 else 0.0
+        print("{:<16} {:>10.4f}s -> {:>10.4f}s {:>+8.1%}".format(name, before, after, change))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the interpreter on the benchmark workloads.")
+    parser.add_argument("workloads", nargs="*", help="names of workloads to run (default: all)")
+    parser.add_argument("--backend", choices=backends, default="interpreted")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --output")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown that counts as a regression (default 0.1)")
+    options = parser.parse_args()
+    set_max_depth(20000)
+
+    paths = sorted(glob.glob(os.path.join(workload_dir, "*.shr")))
+    if len(options.workloads) > 0:
+        paths = [path for path in paths if os.path.splitext(os.path.basename(path))[0] in options.workloads]
+    results = {"backend": options.backend, "python": platform.python_version(), "workloads": {}}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        result = measure(path, options.backend, options.repeat)
+        results["workloads"][name] = result
+        print("{:<16} {:>10.4f}s {:>10} calls {:>12.0f} calls/s {:>10.1f} MB peak".format(
+            name, result["wall"], result["calls"], result["calls_per_sec"], result["peak_bytes"] / 2 ** 20))
+
+    if options.output is not None:
+        with open(options.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if options.baseline is not None:
+        with open(options.baseline, "r") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, options.threshold)
+        if len(regressions) > 0:
+            print("Regressions: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,216 +1,267 @@
+from functools import partial
+
 import numpy
-from copy import deepcopy
-
-from core import Function, value
-
-
-class Add(Function):
-    def __init__(self, name=None):
-        if name is not None:
-            super().__init__(name)
-        else:
-            super().__init__("add")
-        self.add_def([value("a", {}), value("b", {})], "")
-
-    def __repr__(self):
-        return "Add(" + self.name + ")"
-
-    def call(self, args, which, namespace):
-        if self.defs[which] != "":
-            return super().call(args, which, namespace)
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        a = local_namespace["a"]
-        b = local_namespace["b"]
-        remaining_args = args[taken_num:]
-        if isinstance(a, Function) or isinstance(b, Function):
-            result = type(self)(self.name)
-            result.given_args = [a, b]
-            if len(remaining_args) > 0:
-                result.evaluate(remaining_args, namespace)
-            return result
-        result = a + b
-        if len(remaining_args) > 0:
-            raise RuntimeError("Too many arguments for " + self.name)
-        return result
 
+import arrays
+import parallel
+from core import Function, Literal, Name, Apply, register, global_scope
 
-class Mult(Function):
-    def __init__(self, name=None):
-        if name is not None:
-            super().__init__(name)
-        else:
-            super().__init__("mult")
-        self.add_def([value("a", {}), value("b", {})], "")
-
-    def __repr__(self):
-        return "Mult(" + self.name + ")"
-
-    def call(self, args, which, namespace):
-        if self.defs[which] != "":
-            return super().call(args, which, namespace)
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        a = local_namespace["a"]
-        b = local_namespace["b"]
-        remaining_args = args[taken_num:]
-        if isinstance(a, Function) or isinstance(b, Function):
-            result = type(self)(self.name)
-            result.given_args = [a, b]
-            if len(remaining_args) > 0:
-                result.evaluate(remaining_args, namespace)
-            return result
-        result = a * b
-        if len(remaining_args) > 0:
-            raise RuntimeError("Too many arguments for " + self.name)
-        return result
 
+func_dict = {}
 
-class Sub(Function):
-    def __init__(self, name=None):
-        if name is not None:
-            super().__init__(name)
-        else:
-            super().__init__("sub")
-        self.add_def([value("a", {}), value("b", {})], "")
-
-    def __repr__(self):
-        return "Sub(" + self.name + ")"
-
-    def call(self, args, which, namespace):
-        if self.defs[which] != "":
-            return super().call(args, which, namespace)
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        a = local_namespace["a"]
-        b = local_namespace["b"]
-        remaining_args = args[taken_num:]
-        if isinstance(a, Function) or isinstance(b, Function):
-            result = type(self)(self.name)
-            result.given_args = [a, b]
-            if len(remaining_args) > 0:
-                result.evaluate(remaining_args, namespace)
-            return result
-        result = a - b
-        if len(remaining_args) > 0:
-            raise RuntimeError("Too many arguments for " + self.name)
-        return result
 
+@register(func_dict, "add", "a", "b", elementwise=True, ufunc=numpy.add)
+def add(a, b):
+    return arrays.binary("add", a, b)
+
+
+@register(func_dict, "mult", "a", "b", elementwise=True, ufunc=numpy.multiply)
+def mult(a, b):
+    return arrays.binary("mult", a, b)
 
-class Div(Function):
-    def __init__(self, name=None):
-        if name is not None:
-            super().__init__(name)
-        else:
-            super().__init__("div")
-        self.add_def([value("a", {}), value("b", {})], "")
-
-    def __repr__(self):
-        return "Div(" + self.name + ")"
-
-    def call(self, args, which, namespace):
-        if self.defs[which] != "":
-            return super().call(args, which, namespace)
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        a = local_namespace["a"]
-        b = local_namespace["b"]
-        remaining_args = args[taken_num:]
-        if isinstance(a, Function) or isinstance(b, Function):
-            result = type(self)(self.name)
-            result.given_args = [a, b]
-            if len(remaining_args) > 0:
-                result.evaluate(remaining_args, namespace)
-            return result
-        result = a / b
-        if len(remaining_args) > 0:
-            raise RuntimeError("Too many arguments for " + self.name)
-        return result
 
+@register(func_dict, "sub", "a", "b", elementwise=True, ufunc=numpy.subtract)
+def sub(a, b):
+    return arrays.binary("sub", a, b)
 
-class Map(Function):
-    def __init__(self, name=None):
-        if name is not None:
-            super().__init__(name)
-        else:
-            super().__init__("map")
-        self.add_def([value("a", {}), value("b", {})], "")
-
-    def __repr__(self):
-        return "Map(" + self.name + ")"
-
-    def call(self, args, which, namespace):
-        if self.defs[which] != "":
-            return super().call(args, which, namespace)
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        a = local_namespace["a"]
-        b = local_namespace["b"]
-        remaining_args = args[taken_num:]
-        if isinstance(b, Function):
-            result = type(self)(self.name)
-            result.given_args = [a, b]
-            if len(remaining_args) > 0:
-                result.evaluate(remaining_args, namespace)
-            return result
-        if not isinstance(a, Function):
-            raise RuntimeError("Invalid argument for " + self.name)
-        result = numpy.empty_like(b)
-        for i in range(len(b)):
-            result[i] = a.evaluate([b[i]], namespace)
-        if len(remaining_args) > 0:
-            raise RuntimeError("Too many arguments for " + self.name)
+
+@register(func_dict, "div", "a", "b", elementwise=True, ufunc=numpy.true_divide)
+def div(a, b):
+    return arrays.binary("div", a, b)
+
+
+@register(func_dict, "map", "a", "b", functional=(0,), scoped=True)
+def map_array(namespace, a, b):
+    if not isinstance(a, Function):
+        raise RuntimeError("Invalid argument for map")
+    b = arrays.force(b)
+    if isinstance(b, numpy.ndarray) and b.ndim > 0 and vectorizable(a, namespace):
+        result = arrays.force(a.evaluate([b], namespace))
+        if numpy.ndim(result) == 0:
+            result = numpy.full(b.shape, result)
         return result
+    result = None
+    if parallel.usable(b):
+        result = parallel.map_array(a, b, namespace)
+    if result is None:
+        result = numpy.array([arrays.force(a.evaluate([b[i]], namespace)) for i in range(len(b))])
+    return result
+
+
+@register(func_dict, "range", "start", "stop", "step")
+def make_range(start, stop, step):
+    return numpy.arange(start, stop, step)
+
 
+@register(func_dict, "fold", "func", "init", "array", functional=(0, 1), scoped=True)
+def fold(namespace, func, init, array):
+    if not isinstance(func, Function):
+        raise RuntimeError("Invalid argument for fold")
+    array = host_array(array, "fold")
+    ufunc = reducer(func)
+    if ufunc is not None and ufunc is not numpy.true_divide and is_scalar(init):
+        return ufunc.reduce(array, axis=0, dtype=numpy.result_type(array, init), initial=init)
+    result = init
+    for i in range(len(array)):
+        result = arrays.force(func.evaluate([result, array[i]], namespace))
+    return result
 
-class Range(Function):
-    def __init__(self, name=None):
-        if name is not None:
-            super().__init__(name)
-        else:
-            super().__init__("range")
-        self.add_def([value("start", {}), value("stop", {}), value("step", {})], "")
-
-    def __repr__(self):
-        return "Range(" + self.name + ")"
-
-    def call(self, args, which, namespace):
-        if self.defs[which] != "":
-            return super().call(args, which, namespace)
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        start = local_namespace["start"]
-        stop = local_namespace["stop"]
-        step = local_namespace["step"]
-        remaining_args = args[taken_num:]
-        if isinstance(start, Function) or isinstance(stop, Function) or isinstance(step, Function):
-            result = type(self)(self.name)
-            result.given_args = [start, stop, step]
-            if len(remaining_args) > 0:
-                result.evaluate(remaining_args, namespace)
-            return result
-        result = numpy.arange(start, stop, step)
-        if len(remaining_args) > 0:
-            raise RuntimeError("Too many arguments for " + self.name)
+
+@register(func_dict, "sum", "array")
+def total(array):
+    return numpy.sum(host_array(array, "sum"), axis=0)
+
+
+@register(func_dict, "product", "array")
+def product(array):
+    return numpy.prod(host_array(array, "product"), axis=0)
+
+
+@register(func_dict, "filter", "func", "array", functional=(0,), scoped=True)
+def filter_array(namespace, func, array):
+    if not isinstance(func, Function):
+        raise RuntimeError("Invalid argument for filter")
+    array = host_array(array, "filter")
+    if array.ndim > 0 and vectorizable(func, namespace):
+        mask = numpy.asarray(arrays.force(func.evaluate([array], namespace))) != 0
+        return array[numpy.broadcast_to(mask, array.shape)]
+    return numpy.array([array[i] for i in range(len(array)) if truthy(func.evaluate([array[i]], namespace))],
+                       dtype=array.dtype)
+
+
+@register(func_dict, "zip", "first", "second")
+def zip_arrays(first, second):
+    first = host_array(first, "zip")
+    second = host_array(second, "zip")
+    length = min(len(first), len(second))
+    return numpy.stack((first[:length], second[:length]), axis=1)
+
+
+@register(func_dict, "zipWith", "func", "first", "second", functional=(0,), scoped=True)
+def zip_with(namespace, func, first, second):
+    if not isinstance(func, Function):
+        raise RuntimeError("Invalid argument for zipWith")
+    first = host_array(first, "zipWith")
+    second = host_array(second, "zipWith")
+    length = min(len(first), len(second))
+    first = first[:length]
+    second = second[:length]
+    if first.ndim > 0 and second.ndim > 0 and vectorizable(func, namespace, 2):
+        result = arrays.force(func.evaluate([first, second], namespace))
+        if numpy.ndim(result) == 0:
+            result = numpy.full(first.shape, result)
         return result
+    return numpy.array([arrays.force(func.evaluate([first[i], second[i]], namespace)) for i in range(length)])
+
+
+@register(func_dict, "take", "count", "array")
+def take(count, array):
+    if not isinstance(count, (int, numpy.integer)):
+        raise RuntimeError("Invalid argument for take")
+    return host_array(array, "take")[:max(count, 0)]
+
+
+@register(func_dict, "drop", "count", "array")
+def drop(count, array):
+    if not isinstance(count, (int, numpy.integer)):
+        raise RuntimeError("Invalid argument for drop")
+    return host_array(array, "drop")[max(count, 0):]
+
+
+@register(func_dict, "index", "array", "position")
+def index(array, position):
+    array = host_array(array, "index")
+    if not isinstance(position, (int, numpy.integer)) or not -len(array) <= position < len(array):
+        raise RuntimeError("Invalid argument for index")
+    return array[position]
+
+
+@register(func_dict, "load", "path")
+def load(path):
+    if not isinstance(path, str):
+        raise RuntimeError("Invalid argument for load")
+    try:
+        result = numpy.load(path, mmap_mode="r", allow_pickle=False)
+    except (OSError, ValueError) as error:
+        raise RuntimeError("Cannot load " + path + ": " + str(error)) from None
+    if not isinstance(result, numpy.ndarray):
+        result.close()
+        raise RuntimeError("Cannot load " + path + ": expected a .npy file")
+    return result
+
+
+@register(func_dict, "loadraw", "path", "dtype")
+def load_raw(path, dtype):
+    if not isinstance(path, str) or not isinstance(dtype, str):
+        raise RuntimeError("Invalid argument for loadraw")
+    try:
+        return numpy.memmap(path, dtype=numpy.dtype(dtype), mode="r")
+    except (OSError, TypeError, ValueError) as error:
+        raise RuntimeError("Cannot load " + path + ": " + str(error)) from None
+
+
+unary_ufuncs = {"neg": numpy.negative, "abs": numpy.absolute, "sign": numpy.sign, "sqrt": numpy.sqrt,
+                "exp": numpy.exp, "log": numpy.log, "log2": numpy.log2, "log10": numpy.log10,
+                "sin": numpy.sin, "cos": numpy.cos, "tan": numpy.tan, "asin": numpy.arcsin,
+                "acos": numpy.arccos, "atan": numpy.arctan, "sinh": numpy.sinh, "cosh": numpy.cosh,
+                "tanh": numpy.tanh, "floor": numpy.floor, "ceil": numpy.ceil, "round": numpy.rint,
+                "not": numpy.logical_not}
+binary_ufuncs = {"pow": numpy.power, "mod": numpy.mod, "atan2": numpy.arctan2, "max": numpy.maximum,
+                 "min": numpy.minimum, "eq": numpy.equal, "ne": numpy.not_equal, "lt": numpy.less,
+                 "le": numpy.less_equal, "gt": numpy.greater, "ge": numpy.greater_equal,
+                 "and": numpy.logical_and, "or": numpy.logical_or}
+reducible = {numpy.power, numpy.maximum, numpy.minimum}
+
+for name, ufunc in unary_ufuncs.items():
+    register(func_dict, name, "a", elementwise=True)(partial(arrays.apply, ufunc))
+for name, ufunc in binary_ufuncs.items():
+    register(func_dict, name, "a", "b", elementwise=True,
+             ufunc=ufunc if ufunc in reducible else None)(partial(arrays.apply, ufunc))
+register(func_dict, "where", "cond", "a", "b", elementwise=True)(partial(arrays.apply, numpy.where))
+
+
+def host_array(val, name):
+    val = arrays.force(val)
+    backend = arrays.owner(val)
+    if backend is None:
+        raise RuntimeError("Invalid argument for " + name)
+    return numpy.asarray(backend.from_device(val))
+
+
+def truthy(val):
+    return bool(numpy.all(numpy.asarray(arrays.force(val)) != 0))
+
+
+def reducer(func):
+    if func.ufunc is None or func.clauses != 1 or len(func.given_args) > 0 or func.defs[0] is not None:
+        return None
+    return func.ufunc
+
+
+def is_scalar(val):
+    return isinstance(val, (int, float, complex, numpy.number, numpy.bool_))
+
+
+def single_clause(func):
+    if func.clauses == 0 or func.clauses & (func.clauses - 1) != 0:
+        return None
+    return func.clauses.bit_length() - 1
+
+
+def vectorizable(func, namespace, arg_num=1):
+    namespace = global_scope(namespace)
+    which = single_clause(func)
+    if which is None or not all(is_scalar(arg) for arg in func.given_args):
+        return False
+    patterns = func.args[which]
+    if len(patterns) != len(func.given_args) + arg_num:
+        return False
+    if not all(isinstance(pattern, Function) for pattern in patterns[len(func.given_args):]):
+        return False
+    if func.defs[which] is None:
+        return func.elementwise
+    params = {pattern.name for pattern in patterns if isinstance(pattern, Function)}
+    return elementwise_expr(func.defs[which], params, namespace, {func.base})
+
+
+def elementwise_expr(node, params, namespace, seen):
+    if isinstance(node, Literal):
+        return is_scalar(node.value)
+    if isinstance(node, Name):
+        if node.name in params:
+            return True
+        if node.name not in namespace:
+            return False
+        if not isinstance(namespace[node.name], Function):
+            return is_scalar(namespace[node.name])
+        return elementwise_call(namespace[node.name], 0, namespace, seen)
+    if isinstance(node, Apply) and isinstance(node.func, Name) and node.func.name not in params:
+        if not isinstance(namespace.get(node.func.name), Function):
+            return False
+        if not all(elementwise_expr(arg, params, namespace, seen) for arg in node.args):
+            return False
+        return elementwise_call(namespace[node.func.name], len(node.args), namespace, seen)
+    return False
 
 
-func_dict = {"add": Add(), "mult": Mult(), "sub": Sub(), "div": Div(), "map": Map(), "range": Range()}
+def elementwise_call(func, arg_num, namespace, seen):
+    which = single_clause(func)
+    if which is None or len(func.given_args) > 0 or func.base in seen:
+        return False
+    patterns = func.args[which]
+    body = func.defs[which]
+    if not all(isinstance(pattern, Function) for pattern in patterns):
+        return False
+    if body is None:
+        return func.elementwise and len(patterns) == arg_num
+    if len(patterns) == arg_num:
+        params = {pattern.name for pattern in patterns}
+        return elementwise_expr(body, params, namespace, seen | {func.base})
+    if len(patterns) == 0 and isinstance(body, Apply) and isinstance(body.func, Name):
+        if not isinstance(namespace.get(body.func.name), Function):
+            return False
+        if not all(elementwise_expr(arg, set(), namespace, seen) for arg in body.args):
+            return False
+        head = namespace[body.func.name]
+        return elementwise_call(head, len(body.args) + arg_num, namespace, seen | {func.base})
+    return False
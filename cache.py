@@ -0,0 +1,67 @@
+import glob
+import hashlib
+import os
+import pickle
+import sys
+
+import numpy
+
+
+format_version = 1
+enabled = True
+directory = "__shrcache__"
+interpreter = None
+
+
+def interpreter_tag():
+    global interpreter
+    if interpreter is None:
+        digest = hashlib.sha256()
+        digest.update(str(format_version).encode())
+        digest.update(sys.version.encode())
+        digest.update(numpy.__version__.encode())
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(path, "rb") as file:
+                digest.update(file.read())
+        interpreter = digest.hexdigest()
+    return interpreter
+
+
+def source_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def cache_path(path):
+    head, tail = os.path.split(os.path.abspath(path))
+    return os.path.join(head, directory, tail + ".pickle")
+
+
+def load(path, digest):
+    if not enabled:
+        return None
+    try:
+        with open(cache_path(path), "rb") as file:
+            entry = pickle.load(file)
+        if entry["interpreter"] != interpreter_tag() or entry["source"] != digest:
+            return None
+        return entry["ops"], entry["constants"]
+    except Exception:
+        return None
+
+
+def save(path, digest, ops, constants):
+    if not enabled:
+        return
+    target = cache_path(path)
+    temp = target + "." + str(os.getpid())
+    try:
+        entry = {"interpreter": interpreter_tag(), "source": digest, "ops": ops, "constants": constants}
+        data = pickle.dumps(entry)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(temp, "wb") as file:
+            file.write(data)
+        os.replace(temp, target)
+    except Exception:
+        if os.path.exists(temp):
+            os.remove(temp)
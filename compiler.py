@@ -0,0 +1,173 @@
+import numpy
+
+import profiler
+import tracing
+from core import Function, Builtin, Literal, Name, ListLit, TailCall, nomatch, force, value, resolve, global_scope
+from builtin_funcs import add, mult, sub, div
+
+
+operators = {add: "+", mult: "*", sub: "-", div: "/"}
+scalar_types = frozenset([int, float, numpy.int32, numpy.int64, numpy.float32, numpy.float64])
+pattern_types = scalar_types | {str, bool, numpy.bool_, numpy.int8, numpy.int16, numpy.uint8, numpy.uint16,
+                                 numpy.uint32, numpy.uint64, numpy.float16}
+
+
+def apply(func, args, namespace):
+    if not isinstance(func, Function):
+        raise RuntimeError("Cannot apply " + str(func))
+    return func.evaluate(args, namespace)
+
+
+def call(builtin, args, namespace):
+    if profiler.enabled or tracing.enabled:
+        return builtin.evaluate(args, namespace)
+    return builtin.apply(args, namespace)
+
+
+def tail(func, args):
+    if not isinstance(func, Function):
+        raise RuntimeError("Cannot apply " + str(func))
+    return TailCall(func, args)
+
+
+def hashable_literal(pattern):
+    if isinstance(pattern, Function):
+        return False
+    try:
+        hash(pattern)
+    except TypeError:
+        return False
+    return True
+
+
+class Lowering:
+    def __init__(self, func, namespace):
+        self.func = func
+        self.namespace = namespace
+        self.lines = []
+        self.constants = {"_Function": Function, "_TailCall": TailCall, "_nomatch": nomatch, "_force": force,
+                          "_value": value, "_resolve": resolve, "_global_scope": global_scope,
+                          "_apply": apply, "_call": call, "_tail": tail, "_array": numpy.array,
+                          "_array_equal": numpy.array_equal, "_scalar_types": scalar_types,
+                          "_pattern_types": pattern_types, "_ndarray": numpy.ndarray}
+        self.temps = 0
+
+    def constant(self, val):
+        name = "c" + str(len(self.constants))
+        self.constants[name] = val
+        return name
+
+    def temp(self):
+        self.temps += 1
+        return "t" + str(self.temps)
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def source(self):
+        arity = len(self.func.args[0])
+        self.emit(0, "def compiled(args, namespace):")
+        self.emit(1, "if len(args) != " + str(arity) + ":")
+        self.emit(2, "return _nomatch")
+        self.emit(1, "namespace = _global_scope(namespace)")
+        for i in range(arity):
+            self.emit(1, "a" + str(i) + " = _force(args[" + str(i) + "])")
+            if any(hashable_literal(patterns[i]) for patterns in self.func.args):
+                arg = "a" + str(i)
+                self.emit(1, "if " + arg + ".__class__ not in _pattern_types and not isinstance(" + arg + ", _ndarray):")
+                self.emit(2, "return _nomatch")
+        for patterns, body in zip(self.func.args, self.func.defs):
+            tests = []
+            env = {}
+            for i in range(arity):
+                arg = "a" + str(i)
+                if isinstance(patterns[i], Function):
+                    env[patterns[i].name] = arg
+                    continue
+                pattern = self.constant(patterns[i])
+                if hashable_literal(patterns[i]):
+                    tests.append("(" + arg + ".__class__ in _pattern_types and " + arg + " == " + pattern + ")")
+                else:
+                    tests.append("_array_equal(" + arg + ", " + pattern + ")")
+            if len(tests) == 0:
+                self.emit(1, "return " + self.expr(body, env, 1, True))
+                break
+            self.emit(1, "if " + " and ".join(tests) + ":")
+            self.emit(2, "return " + self.expr(body, env, 2, True))
+        else:
+            self.emit(1, "return _nomatch")
+        return "\n".join(self.lines) + "\n"
+
+    def expr(self, node, env, indent, is_tail=False):
+        if isinstance(node, Literal):
+            if type(node.value) is int:
+                return repr(node.value)
+            return self.constant(node.value)
+        if isinstance(node, ListLit):
+            items = [self.expr(item, env, indent) for item in node.items]
+            return "_array([" + ", ".join(items) + "])"
+        if isinstance(node, Name):
+            if node.name in env:
+                return env[node.name]
+            return "_value(" + self.constant(node) + ", namespace)"
+        args = [self.expr(arg, env, indent) for arg in node.args]
+        head = node.func
+        if isinstance(head, Name) and head.name not in env:
+            builtin = self.namespace.get(head.name)
+            if isinstance(builtin, Builtin) and len(args) == builtin.arity:
+                if builtin.impl in operators:
+                    return self.operator(builtin, args, indent)
+                result = self.temp()
+                self.emit(indent, result + " = _call(" + self.constant(builtin) + ", [" + ", ".join(args) + "], namespace)")
+                return result
+            func = "_resolve(" + self.constant(head) + ", namespace)"
+        else:
+            func = self.expr(head, env, indent)
+        if is_tail:
+            return "_tail(" + func + ", [" + ", ".join(args) + "])"
+        result = self.temp()
+        self.emit(indent, result + " = _apply(" + func + ", [" + ", ".join(args) + "], namespace)")
+        return result
+
+    def operator(self, builtin, args, indent):
+        left = self.temp()
+        right = self.temp()
+        result = self.temp()
+        self.emit(indent, left + " = " + args[0])
+        self.emit(indent, right + " = " + args[1])
+        self.emit(indent, "if " + left + ".__class__ in _scalar_types and " + right + ".__class__ in _scalar_types:")
+        self.emit(indent + 1, result + " = " + left + " " + operators[builtin.impl] + " " + right)
+        self.emit(indent, "else:")
+        self.emit(indent + 1, result + " = _call(" + self.constant(builtin) + ", [" + left + ", " + right + "], namespace)")
+        return result
+
+
+max_clauses = 16
+
+
+def compilable(func):
+    if not 0 < len(func.args) <= max_clauses or any(body is None for body in func.defs):
+        return False
+    if len(func.args[0]) == 0:
+        return False
+    return all(len(patterns) == len(func.args[0]) for patterns in func.args)
+
+
+def compile_function(func, namespace):
+    if not compilable(func):
+        return None
+    lowering = Lowering(func, global_scope(namespace))
+    code = compile(lowering.source(), "<compiled " + func.name + ">", "exec")
+    scope = dict(lowering.constants)
+    exec(code, scope)
+    return scope["compiled"]
+
+
+def prepare(func):
+    def first_call(args, namespace):
+        if func.compiled is first_call:
+            func.compiled = compile_function(func, namespace)
+        if func.compiled is None:
+            return nomatch
+        return func.compiled(args, namespace)
+    func.compiled = first_call
@@ -1,144 +1,769 @@
+import re
+import sys
+import threading
+
 import numpy
-from copy import deepcopy
 
+import memo
+import profiler
+import tracing
 
-enable_log = True
-log_file = "log.txt"
-log_indent = 0
 
+max_depth = 10000
+frames_per_call = 20
+call_by_need = False
+fork = None
+interrupt = None
+calls = threading.local()
 
-class Function:
-    def __init__(self, name):
-        self.name = name
+
+class Clauses:
+    __slots__ = ("args", "defs", "wildcards", "literals", "unhashable", "arity_masks", "owner", "constants")
+
+    def __init__(self, owner=None):
         self.args = []
         self.defs = []
-        self.given_args = []
+        self.wildcards = []
+        self.literals = []
+        self.unhashable = []
+        self.arity_masks = [0]
+        self.owner = owner
+        self.constants = {}
 
-    def __str__(self):
-        string = self.name
-        for arg in self.given_args:
-            if separate(str(arg))[0] != str(arg):
-                string += " (" + str(arg) + ")"
+    def __getstate__(self):
+        state = {key: getattr(self, key) for key in Clauses.__slots__}
+        state["constants"] = {}
+        return state
+
+    def __setstate__(self, state):
+        for key, val in state.items():
+            setattr(self, key, val)
+
+    def copy(self, owner):
+        table = Clauses(owner)
+        table.args = list(self.args)
+        table.defs = list(self.defs)
+        table.wildcards = list(self.wildcards)
+        table.literals = [dict(literals) for literals in self.literals]
+        table.unhashable = [list(unhashable) for unhashable in self.unhashable]
+        table.arity_masks = list(self.arity_masks)
+        return table
+
+    def add(self, args, body, clauses):
+        bit = 1 << len(self.args)
+        self.args.append(args)
+        self.defs.append(body)
+        self.constants.clear()
+        while len(self.wildcards) < len(args):
+            self.wildcards.append(clauses)
+            self.literals.append({})
+            self.unhashable.append([])
+            self.arity_masks.append(self.arity_masks[-1])
+        for i in range(len(self.wildcards)):
+            if i >= len(args) or isinstance(args[i], Function):
+                self.wildcards[i] |= bit
             else:
-                string += " " + str(arg)
-        return string
+                try:
+                    self.literals[i][args[i]] = self.literals[i].get(args[i], 0) | bit
+                except TypeError:
+                    self.unhashable[i].append((args[i], bit))
+        for n in range(len(args), len(self.arity_masks)):
+            self.arity_masks[n] |= bit
+        return bit
+
+
+natives = {}
+
+
+def native(*params):
+    if params not in natives:
+        table = Clauses()
+        table.add([Function(param) for param in params], None, 0)
+        natives[params] = table
+    return natives[params]
+
+
+class Function:
+    __slots__ = ("name", "table", "given_args", "base", "clauses", "compiled")
+    elementwise = False
+    ufunc = None
+    impl = None
+
+    def __init__(self, name, table=None):
+        self.name = name
+        self.given_args = ()
+        self.base = self
+        self.compiled = None
+        if table is None:
+            self.table = Clauses(self)
+            self.clauses = 0
+        else:
+            self.table = table
+            self.clauses = (1 << len(table.args)) - 1
+
+    def __str__(self):
+        return describe(self.name, self.given_args)
 
     def __repr__(self):
         return "Function(" + self.name + ")"
 
+    def __getstate__(self):
+        state = {key: getattr(self, key) for key in Function.__slots__}
+        state["compiled"] = None
+        return state
+
+    def __setstate__(self, state):
+        for key, val in state.items():
+            setattr(self, key, val)
+
+    @property
+    def args(self):
+        return self.table.args
+
+    @property
+    def defs(self):
+        return self.table.defs
+
     def add_def(self, args, body):
-        self.args.append(args)
-        self.defs.append(body)
+        if self.table.owner is not self:
+            self.table = self.table.copy(self)
+        self.clauses |= self.table.add(args, parse(body) if isinstance(body, str) else body, self.clauses)
+
+    def matching(self, i, arg):
+        table = self.table
+        if isinstance(arg, Thunk) and (len(table.literals[i]) > 0 or len(table.unhashable[i]) > 0):
+            arg = arg.force()
+        mask = table.wildcards[i]
+        try:
+            mask |= table.literals[i].get(arg, 0)
+        except TypeError:
+            pass
+        for pattern, bit in table.unhashable[i]:
+            if numpy.array_equal(arg, pattern):
+                mask |= bit
+        return mask
+
+    def select(self, args):
+        candidates = self.clauses
+        arity_masks = self.table.arity_masks
+        for i in range(len(self.given_args), min(len(args), len(self.table.wildcards))):
+            if candidates == 0:
+                break
+            candidates &= self.matching(i, args[i])
+        if len(args) < len(arity_masks):
+            fitting = candidates & arity_masks[len(args)]
+        else:
+            fitting = candidates
+        if fitting == 0:
+            return candidates, None
+        return candidates, (fitting & -fitting).bit_length() - 1
 
     def evaluate(self, new_args, namespace):
-        args = self.given_args + new_args
-        if enable_log:
-            string = self.name
-            for arg in args:
-                if separate(str(arg))[0] != str(arg):
-                    string += " (" + str(arg) + ")"
+        depth = getattr(calls, "depth", 0)
+        if self.impl is None:
+            if depth >= max_depth:
+                raise RecursionError("Maximum recursion depth exceeded")
+            calls.depth = depth + 1
+        try:
+            args = [*self.given_args, *new_args]
+            if tracing.enabled:
+                call = Call(self.name, args)
+                tracing.emit(tracing.CALLS, "(start)   evaluating {}", (call,), 1)
+            if profiler.enabled:
+                profiler.enter(self.name)
+            func = self
+            pending = []
+            partial = False
+            while True:
+                if interrupt is not None:
+                    interrupt()
+                if func.impl is not None and len(args) >= func.arity:
+                    result = func.apply(args, namespace)
+                    break
+                recalled = False
+                if func.compiled is not None:
+                    if memo.enabled:
+                        result = recall(func, args, pending)
+                        if result is not memo.missing:
+                            break
+                        recalled = True
+                    result = func.compiled(args, namespace)
+                    if isinstance(result, TailCall):
+                        if profiler.enabled:
+                            profiler.switch(result.func.name)
+                        func = result.func
+                        args = [*func.given_args, *result.args]
+                        namespace = global_scope(namespace)
+                        continue
+                    if result is not nomatch:
+                        break
+                candidates, which = func.select(args)
+                if which is None:
+                    result = Partial(func, args, candidates)
+                    partial = True
+                    break
+                body = func.table.defs[which]
+                if body is None:
+                    if call_by_need:
+                        args = [force(arg) for arg in args]
+                    result = func.call(args, which, namespace)
+                    break
+                if len(func.table.args[which]) == 0:
+                    result = constant(func, which, namespace)
+                    if len(args) == 0:
+                        break
+                    if not isinstance(result, Function):
+                        raise RuntimeError("Too many arguments for " + func.name)
+                    func = result
+                    args = [*result.given_args, *args]
+                    continue
+                if memo.enabled and not recalled:
+                    result = recall(func, args, pending)
+                    if result is not memo.missing:
+                        break
+                if not isinstance(body, Apply) or len(args) != len(func.table.args[which]):
+                    result = func.call(args, which, namespace)
+                    break
+                local_namespace = bind(func.table.args[which], args, namespace)
+                target = resolve(body.func, local_namespace)
+                tail_args = arguments(body.args, local_namespace)
+                if not isinstance(target, Function):
+                    raise RuntimeError("Cannot apply " + str(target) + " in " + str(body))
+                if profiler.enabled:
+                    profiler.switch(target.name)
+                func = target
+                args = [*target.given_args, *tail_args]
+                namespace = local_namespace
+            for key in pending:
+                memo.put(key, result)
+            if profiler.enabled:
+                profiler.leave(partial, partial and candidates == 0 and func.clauses != 0)
+            if tracing.enabled:
+                if partial:
+                    tracing.emit(tracing.CALLS, "(partial) evaluating {} got {}", (call, result), -1)
                 else:
-                    string += " " + str(arg)
-            log("(start)   evaluating " + string + " " + str(namespace), 1)
-        arg_matches = deepcopy(self.args)
-        for i in range(len(self.given_args), len(args)):
-            for j in range(len(self.args)):
-                if i < len(self.args[j]) and not isinstance(self.args[j][i], Function):
-                    if args[i] != self.args[j][i]:
-                        arg_matches[j] = None
-        for i in range(len(arg_matches)):
-            if arg_matches[i] is not None and len(arg_matches[i]) <= len(args):
-                result = self.call(args, i, namespace)
-                if enable_log:
-                    log("(full)    evaluating " + string + " got " + str(result), -1)
-                return result
-        matches = [arg for arg in arg_matches if arg is not None]
-        defs = [self.defs[i] for i in range(len(arg_matches)) if arg_matches[i] is not None]
-        result = type(self)(self.name)
-        for i in range(len(matches)):
-            result.add_def(matches[i], defs[i])
-        result.given_args = args
-        if enable_log:
-            log("(partial) evaluating " + string + " got " + str(result), -1)
-        return result
+                    tracing.emit(tracing.CALLS, "(full)    evaluating {} got {}", (call, result), -1)
+            return result
+        finally:
+            calls.depth = depth
 
     def call(self, args, which, namespace):
-        taken_num = len(self.args[which])
-        local_namespace = deepcopy(namespace)
-        for i in range(taken_num):
-            if isinstance(self.args[which][i], Function):
-                local_namespace[self.args[which][i].name] = args[i]
-        body_parts = [value(part, local_namespace) for part in separate(self.defs[which])]
-        if not isinstance(body_parts[0], Function):
-            return body_parts[0]
-        func = body_parts[0]
-        func_args = body_parts[1:]
-        result = func.evaluate(func_args, local_namespace)
+        taken_num = len(self.table.args[which])
+        local_namespace = bind(self.table.args[which], args, namespace)
+        result = value(self.table.defs[which], local_namespace)
         remaining_args = args[taken_num:]
-        if not isinstance(result, Function):
-            if len(remaining_args) > 0:
-                raise RuntimeError("Too many arguments for " + self.name)
+        if len(remaining_args) == 0:
             return result
+        if not isinstance(result, Function):
+            raise RuntimeError("Too many arguments for " + self.name)
         return result.evaluate(remaining_args, namespace)
 
 
-def value(string, namespace):
-    if enable_log:
-        log("(start)   finding value of " + string + " " + str(namespace), 1)
-    stripped = string.strip()
-    while stripped[0] == "(" and stripped[-1] == ")":
-        stripped = stripped[1:-1]
-    if stripped[0] == stripped[-1] == '"':
-        result = stripped[1:-1]
-        if enable_log:
-            log("(value)   value of " + string + " is " + str(result), -1)
-        return result
-    if stripped[0] == "[" and stripped[-1] == "]":
-        parts = separate(stripped[1:-1])
-        val = []
-        for part in parts:
-            val.append(value(part, namespace))
-        result = numpy.array(val)
-        if enable_log:
-            log("(value)   value of " + string + " is " + str(result), -1)
+class Partial(Function):
+    __slots__ = ()
+
+    def __init__(self, func, args, clauses=None):
+        self.name = func.name
+        self.table = func.table
+        self.given_args = tuple(args)
+        self.base = func.base
+        self.clauses = func.clauses if clauses is None else clauses
+        self.compiled = func.compiled
+
+    def __repr__(self):
+        return "Partial(" + repr(self.base) + ", " + repr(list(self.given_args)) + ")"
+
+    @property
+    def elementwise(self):
+        return self.base.elementwise
+
+    @property
+    def ufunc(self):
+        return self.base.ufunc
+
+    @property
+    def impl(self):
+        return self.base.impl
+
+    @property
+    def arity(self):
+        return self.base.arity
+
+    def apply(self, args, namespace):
+        return self.base.apply(args, namespace)
+
+    def call(self, args, which, namespace):
+        return self.base.call(args, which, namespace)
+
+
+class Builtin(Function):
+    __slots__ = ("impl", "arity", "data", "scoped", "elementwise", "ufunc")
+
+    def __init__(self, name, impl, params, functional=(), scoped=False, elementwise=False, ufunc=None):
+        super().__init__(name, native(*params))
+        self.impl = impl
+        self.arity = len(params)
+        self.data = tuple(i for i in range(len(params)) if i not in functional)
+        self.scoped = scoped
+        self.elementwise = elementwise
+        self.ufunc = ufunc
+
+    def __repr__(self):
+        return "Builtin(" + self.name + ")"
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        for key in Builtin.__slots__:
+            state[key] = getattr(self, key)
+        return state
+
+    def apply(self, args, namespace):
+        if call_by_need:
+            args = [force(arg) for arg in args]
+        taken = args[:self.arity]
+        if any(isinstance(taken[i], Function) for i in self.data):
+            return Partial(self, args)
+        if self.scoped:
+            result = self.impl(namespace, *taken)
+        else:
+            result = self.impl(*taken)
+        if len(args) == self.arity:
+            return result
+        if not isinstance(result, Function):
+            raise RuntimeError("Too many arguments for " + self.name)
+        return result.evaluate(args[self.arity:], namespace)
+
+    def call(self, args, which, namespace):
+        return self.apply(args, namespace)
+
+
+def register(table, name, *params, functional=(), scoped=False, elementwise=False, ufunc=None):
+    def declare(impl):
+        table[name] = Builtin(name, impl, params, functional, scoped, elementwise, ufunc)
+        return impl
+    return declare
+
+
+class TailCall:
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+
+nomatch = object()
+missing = object()
+
+
+def constant(func, which, namespace):
+    constants = func.table.constants
+    if which not in constants:
+        constants[which] = value(func.table.defs[which], global_scope(namespace))
+    return constants[which]
+
+
+def recall(func, args, pending):
+    if call_by_need:
+        args = [arg.value if isinstance(arg, Thunk) else arg for arg in args]
+        if any(arg is missing for arg in args):
+            return memo.missing
+    key = memo.make_key(func.base, args)
+    if key is None:
+        return memo.missing
+    result = memo.get(key)
+    if result is memo.missing:
+        pending.append(key)
+    return result
+
+
+class Call:
+    __slots__ = ("name", "args")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __str__(self):
+        return describe(self.name, self.args)
+
+
+def describe(name, args):
+    string = name
+    for arg in args:
+        if separate(str(arg))[0] != str(arg):
+            string += " (" + str(arg) + ")"
+        else:
+            string += " " + str(arg)
+    return string
+
+
+class Scope(dict):
+    fork_join = False
+
+    def __init__(self, bindings=(), parent=None, local=False):
+        super().__init__(bindings)
+        self.parent = parent
+        if local:
+            self.globals = global_scope(parent)
+        else:
+            self.globals = self
+
+    def __missing__(self, key):
+        if self.parent is None:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        return self.parent is not None and key in self.parent
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+def global_scope(namespace):
+    if isinstance(namespace, Scope):
+        return namespace.globals
+    return namespace
+
+
+def bind(patterns, args, namespace):
+    local_namespace = Scope(parent=global_scope(namespace), local=True)
+    for i in range(len(patterns)):
+        if isinstance(patterns[i], Function):
+            local_namespace[patterns[i].name] = args[i]
+    return local_namespace
+
+
+class Literal:
+    __slots__ = ("value",)
+
+    def __init__(self, val):
+        self.value = val
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            return '"' + self.value + '"'
+        return str(self.value)
+
+    def __repr__(self):
+        return "Literal(" + repr(self.value) + ")"
+
+
+class Name:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "Name(" + self.name + ")"
+
+
+class Apply:
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = tuple(args)
+
+    def __str__(self):
+        return " ".join(bracket(node) for node in (self.func,) + self.args)
+
+    def __repr__(self):
+        return "Apply(" + repr(self.func) + ", " + repr(list(self.args)) + ")"
+
+
+class ListLit:
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = tuple(items)
+
+    def __str__(self):
+        return "[" + " ".join(bracket(node) for node in self.items) + "]"
+
+    def __repr__(self):
+        return "ListLit(" + repr(list(self.items)) + ")"
+
+
+def bracket(node):
+    if isinstance(node, Apply):
+        return "(" + str(node) + ")"
+    return str(node)
+
+
+def references(node):
+    if isinstance(node, Name):
+        return {node.name}
+    if isinstance(node, Apply):
+        names = references(node.func)
+        for arg in node.args:
+            names |= references(arg)
+        return names
+    if isinstance(node, ListLit):
+        names = set()
+        for item in node.items:
+            names |= references(item)
+        return names
+    return set()
+
+
+def resolve(node, namespace):
+    if isinstance(node, Name):
+        if node.name not in namespace:
+            return Function(node.name)
+        if isinstance(namespace[node.name], Function):
+            return namespace[node.name]
+    return value(node, namespace)
+
+
+class Thunk:
+    __slots__ = ("node", "namespace", "value")
+
+    def __init__(self, node, namespace):
+        self.node = node
+        self.namespace = namespace
+        self.value = missing
+
+    def force(self):
+        if self.value is missing:
+            self.value = value(self.node, self.namespace)
+            self.node = None
+            self.namespace = None
+        return self.value
+
+    def __str__(self):
+        node = self.node
+        if self.value is missing and node is not None:
+            return str(node)
+        return str(self.value)
+
+    def __repr__(self):
+        node = self.node
+        if self.value is missing and node is not None:
+            return "Thunk(" + repr(node) + ")"
+        return "Thunk(" + repr(self.value) + ")"
+
+
+def delay(node, namespace):
+    if isinstance(node, Literal):
+        return node.value
+    if isinstance(node, Name) and node.name in namespace and not isinstance(namespace[node.name], Function):
+        return namespace[node.name]
+    return Thunk(node, namespace)
+
+
+def force(val):
+    if isinstance(val, Thunk):
+        return val.force()
+    return val
+
+
+def arguments(nodes, namespace):
+    if call_by_need:
+        return [delay(node, namespace) for node in nodes]
+    if fork is not None:
+        args = fork(nodes, namespace)
+        if args is not None:
+            return args
+    return [value(node, namespace) for node in nodes]
+
+
+def set_call_by_need(on):
+    global call_by_need
+    call_by_need = on
+
+
+def set_fork(hook):
+    global fork
+    fork = hook
+
+
+def set_interrupt(hook):
+    global interrupt
+    interrupt = hook
+
+
+def set_max_depth(depth):
+    global max_depth
+    max_depth = depth
+    sys.setrecursionlimit(depth * frames_per_call + 1000)
+
+
+def value(expr, namespace):
+    if isinstance(expr, str):
+        expr = parse(expr)
+    if tracing.enabled:
+        tracing.emit(tracing.VALUES, "(start)   finding value of {}", (expr,), 1)
+    if isinstance(expr, Literal):
+        result = expr.value
+        if tracing.enabled:
+            tracing.emit(tracing.VALUES, "(value)   value of {} is {}", (expr, result), -1)
         return result
-    try:
-        val = numpy.int(stripped)
-    except ValueError:
-        pass
-    else:
-        result = val
-        if enable_log:
-            log("(value)   value of " + string + " is " + str(result), -1)
+    if isinstance(expr, ListLit):
+        result = numpy.array([value(item, namespace) for item in expr.items])
+        if tracing.enabled:
+            tracing.emit(tracing.VALUES, "(value)   value of {} is {}", (expr, result), -1)
         return result
-    try:
-        val = numpy.float32(stripped)
-    except ValueError:
-        pass
+    if isinstance(expr, Name):
+        name = expr.name
+        args = []
     else:
-        result = val
-        if enable_log:
-            log("(value)   value of " + string + " is " + str(result), -1)
-        return result
-    parts = separate(stripped)
-    name = parts[0]
-    args = [value(arg, namespace) for arg in parts[1:]]
+        args = arguments(expr.args, namespace)
+        if not isinstance(expr.func, Name):
+            func = value(expr.func, namespace)
+            if not isinstance(func, Function):
+                raise RuntimeError("Cannot apply " + str(func) + " in " + str(expr))
+            result = func.evaluate(args, namespace)
+            if tracing.enabled:
+                tracing.emit(tracing.VALUES, "(apply)   value of {} is {}", (expr, result), -1)
+            return result
+        name = expr.func.name
     if name in namespace:
-        if not isinstance(namespace[name], Function):
-            result = namespace[name]
-            if enable_log:
-                log("(name)    value of " + string + " is " + str(result), -1)
+        bound = namespace[name]
+        if isinstance(bound, Thunk):
+            bound = bound.force()
+        if not isinstance(bound, Function):
+            if len(args) > 0:
+                raise RuntimeError("Cannot apply " + name + " in " + str(expr))
+            result = bound
+            if tracing.enabled:
+                tracing.emit(tracing.VALUES, "(name)    value of {} is {}", (expr, result), -1)
             return result
-        result = namespace[name].evaluate(args, namespace)
-        if enable_log:
-            log("(namefun) value of " + string + " is " + str(result), -1)
+        result = bound.evaluate(args, namespace)
+        if tracing.enabled:
+            tracing.emit(tracing.VALUES, "(namefun) value of {} is {}", (expr, result), -1)
         return result
     result = Function(name).evaluate(args, namespace)
-    if enable_log:
-        log("(func)    value of " + string + " is " + str(result), -1)
+    if tracing.enabled:
+        tracing.emit(tracing.VALUES, "(func)    value of {} is {}", (expr, result), -1)
     return result
 
 
+def tokenize(string):
+    tokens = []
+    i = 0
+    length = len(string)
+    while i < length:
+        char = string[i]
+        if char.isspace():
+            i += 1
+        elif char in "()[]":
+            bulk = bulk_list(string, i) if char == "[" else None
+            if bulk is not None:
+                tokens.append(bulk[0])
+                i = bulk[1]
+            else:
+                tokens.append(char)
+                i += 1
+        elif char == '"':
+            end = string.find('"', i + 1)
+            if end == -1:
+                raise RuntimeError("Unterminated string in " + string)
+            tokens.append(Literal(string[i + 1:end]))
+            i = end + 1
+        else:
+            start = i
+            while i < length and not string[i].isspace() and string[i] not in '()[]"':
+                i += 1
+            tokens.append(atom(string[start:i]))
+    return tokens
+
+
+numeric_text = re.compile(r"[0-9eE+\-.\s]*")
+
+
+def bulk_list(string, start):
+    end = string.find("]", start + 1)
+    if end == -1:
+        return None
+    text = string[start + 1:end]
+    if not numeric_text.fullmatch(text):
+        return None
+    tokens = text.split()
+    if len(tokens) == 0:
+        return None
+    if any(marker in text for marker in ".eE"):
+        if not all("." in token or "e" in token or "E" in token for token in tokens):
+            return None
+        dtype = numpy.float32
+    else:
+        dtype = numpy.int64
+    try:
+        result = numpy.array(tokens, dtype=dtype)
+    except (ValueError, OverflowError):
+        return None
+    result.flags.writeable = False
+    return Literal(result), end + 1
+
+
+def atom(text):
+    try:
+        return Literal(int(text))
+    except ValueError:
+        pass
+    try:
+        return Literal(numpy.float32(text))
+    except ValueError:
+        pass
+    return Name(text)
+
+
+def parse(string):
+    tokens = tokenize(string)
+    if len(tokens) == 0:
+        return None
+    node, pos = parse_sequence(tokens, 0, string)
+    if pos != len(tokens):
+        raise RuntimeError("Unbalanced brackets in " + string)
+    return node
+
+
+def parse_sequence(tokens, pos, string):
+    nodes = []
+    while pos < len(tokens) and not is_closing(tokens[pos]):
+        node, pos = parse_atom(tokens, pos, string)
+        nodes.append(node)
+    if len(nodes) == 0:
+        raise RuntimeError("Empty expression in " + string)
+    if len(nodes) == 1:
+        return nodes[0], pos
+    return Apply(nodes[0], nodes[1:]), pos
+
+
+def parse_atom(tokens, pos, string):
+    token = tokens[pos]
+    if token == "(":
+        node, pos = parse_sequence(tokens, pos + 1, string)
+        if pos >= len(tokens) or tokens[pos] != ")":
+            raise RuntimeError("Unbalanced brackets in " + string)
+        return node, pos + 1
+    if token == "[":
+        items = []
+        pos += 1
+        while pos < len(tokens) and not is_closing(tokens[pos]):
+            node, pos = parse_atom(tokens, pos, string)
+            items.append(node)
+        if pos >= len(tokens) or tokens[pos] != "]":
+            raise RuntimeError("Unbalanced brackets in " + string)
+        return ListLit(items), pos + 1
+    if is_closing(token):
+        raise RuntimeError("Unbalanced brackets in " + string)
+    return token, pos + 1
+
+
+def is_closing(token):
+    return isinstance(token, str) and token in ")]"
+
+
 def separate(string):
     parts = []
     paren_depth = 0
@@ -165,9 +790,3 @@ def separate(string):
         parts.append(string[part_start:])
     return parts
 
-
-def log(string, ind_inc):
-    global log_indent
-    with open(log_file, "a") as file:
-        file.write("  " * log_indent + string + "\n")
-    log_indent += ind_inc
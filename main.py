@@ -1,33 +1,74 @@
-from copy import deepcopy
+import argparse
+import json
+import pickle
+import sys
+from copy import copy
 
-from core import Function, value, separate, enable_log, log_file
+import numpy
+
+import arrays
+import cache
+import compiler
+import memo
+import parallel
+import profiler
+import tracing
+from core import Function, Builtin, Apply, Scope, value, parse, references, set_max_depth, set_call_by_need, max_depth
 from builtin_funcs import func_dict
 from builtin_funcs_CUDA import func_dict_CUDA
 
 
+backends = ["interpreted", "compiled"]
+file_readers = {"load", "loadraw"}
+
+
 class Program:
-    def __init__(self):
-        self.functions = deepcopy(func_dict)
-        for key, val in func_dict_CUDA.items():
-            self.functions[key] = val
+    def __init__(self, backend="interpreted", fork_join=False, defines=None, inputs=None, records=None,
+                 library=None):
+        if backend not in backends:
+            raise RuntimeError("Unknown backend " + backend)
+        self.backend = backend
+        if library is None:
+            self.functions = Scope({name: copy(func) for name, func in func_dict.items()})
+            for key, val in func_dict_CUDA.items():
+                self.functions[key] = copy(val)
+            self.protected = set()
+        else:
+            self.functions = Scope(parent=library.functions)
+            self.protected = library.names()
+        self.functions.fork_join = fork_join
+        self.dependents = {}
+        self.defines = defines if defines is not None else {}
+        self.inputs = inputs
+        self.records = records
+        self.location = None
+        self.pending = []
+        self.log = None
 
     def read_line(self, line):
-        if line.isspace():
+        op = self.translate(line)
+        if op is None:
             return True
+        return self.execute(op)
+
+    def translate(self, line):
+        if line.isspace():
+            return None
         parts = line.split("=")
         if len(parts) > 2:
             raise RuntimeError("Expected func arg1 arg2 .. argN = def, got " + line)
         elif len(parts) == 2:
             declaration = parts[0].strip()
             definition = parts[1].strip()
-            dec_parts = separate(declaration)
-            name = dec_parts[0]
-            args = dec_parts[1:]
+            dec = parse(declaration)
+            if isinstance(dec, Apply):
+                name = str(dec.func)
+                args = dec.args
+            else:
+                name = str(dec)
+                args = []
             arg_vals = [value(arg, {}) for arg in args]
-            if name not in self.functions:
-                self.functions[name] = Function(name)
-            self.functions[name].add_def(arg_vals, definition)
-            return True
+            return "define", name, arg_vals, parse(definition)
         else:
             action_parts = parts[0].split(":")
             if len(action_parts) == 2:
@@ -37,23 +78,235 @@ class Program:
                 action = "output"
             else:
                 raise RuntimeError("Expected action : data, got " + line)
-            return self.run(action.strip(), data.strip())
+            return "action", action.strip(), data.strip()
+
+    def execute(self, op):
+        if op[0] == "define":
+            self.define(op[1], op[2], op[3])
+            return True
+        return self.run(op[1], op[2])
+
+    def define(self, name, arg_vals, body):
+        self.writable(name)
+        self.invalidate(name)
+        func = self.functions.get(name)
+        if not isinstance(func, Function) or isinstance(func, Builtin) or len(arg_vals) == 0:
+            self.functions[name] = Function(name)
+        elif not dict.__contains__(self.functions, name):
+            self.functions[name] = copy(func)
+        func = self.functions[name]
+        func.add_def(arg_vals, body)
+        if body is not None:
+            for ref in references(body):
+                self.dependents.setdefault(ref, set()).add(name)
+        if self.backend == "compiled":
+            compiler.prepare(func)
+
+    def run_file(self, path):
+        digest = cache.source_hash(path)
+        before = set(dict.keys(self.functions))
+        cached = cache.load(path, digest)
+        if cached is not None:
+            ops, constants = cached
+            finished = self.replay(path, before, ops, constants)
+        else:
+            ops = []
+            constants = None
+            finished = True
+            with open(path, "r") as file:
+                for number, line in enumerate(file, 1):
+                    self.location = path, number
+                    op = self.translate(line)
+                    if op is None:
+                        continue
+                    ops.append((number, op))
+                    if not self.execute(op):
+                        finished = False
+                        break
+        defined = {}
+        for number, op in ops:
+            if op[0] == "define":
+                func = self.functions.get(op[1])
+                if isinstance(func, Function) and func.name == op[1] and func.table.owner is func:
+                    defined[op[1]] = func, len(func.defs)
+        self.pending.append((path, digest, ops, constants, before, defined))
+        return finished
+
+    def replay(self, path, before, ops, constants):
+        restore = {}
+        for name, (index, closure, constant) in constants.items():
+            if all(ref not in before or self.pristine(ref) for ref in closure):
+                restore.setdefault(index, []).append((name, constant))
+        for index, (number, op) in enumerate(ops):
+            self.location = path, number
+            if not self.execute(op):
+                return False
+            for name, constant in restore.get(index, ()):
+                self.functions[name].table.constants.update(constant)
+        return True
+
+    def close(self):
+        for path, digest, ops, cached, before, defined in self.pending:
+            constants = self.cacheable(ops, before, defined)
+            if cached is None or not constants.keys() <= cached.keys():
+                cache.save(path, digest, ops, constants)
+        self.pending = []
+
+    def writable(self, name):
+        if name in self.protected:
+            raise RuntimeError("Cannot redefine " + name + ", the library depends on it")
+
+    def names(self):
+        names = set()
+        for name, func in dict.items(self.functions):
+            if not self.pristine(name):
+                names |= self.closure(name)
+        return names | self.protected
+
+    def pristine(self, name):
+        func = self.functions.get(name)
+        return isinstance(func, Function) and func.table.owner is None
+
+    def closure(self, name):
+        names = set()
+        stale = [name]
+        while len(stale) > 0:
+            current = stale.pop()
+            if current in names:
+                continue
+            names.add(current)
+            func = self.functions.get(current)
+            if isinstance(func, Function) and func.table.owner is func:
+                for patterns, body in zip(func.args, func.defs):
+                    if body is not None:
+                        params = {pattern.name for pattern in patterns if isinstance(pattern, Function)}
+                        stale.extend(references(body) - params)
+        return names
+
+    def unchanged(self, name, before, defined, inputs):
+        if name in defined:
+            func, clauses = defined[name]
+            return (name not in before and name not in inputs and self.functions.get(name) is func
+                    and len(func.defs) == clauses)
+        return name not in self.functions or self.pristine(name)
+
+    def cacheable(self, ops, before, defined):
+        inputs = {op[2] for number, op in ops if op[0] == "action" and op[1] == "input"}
+        index = {}
+        for position, (number, op) in enumerate(ops):
+            if op[0] == "define":
+                index[op[1]] = position
+        constants = {}
+        for name, (func, clauses) in defined.items():
+            if len(func.table.constants) == 0:
+                continue
+            closure = self.closure(name)
+            if not closure.isdisjoint(file_readers):
+                continue
+            if not all(self.unchanged(ref, before, defined, inputs) for ref in closure):
+                continue
+            constant = dict(func.table.constants)
+            if any(isinstance(val, Function) for val in constant.values()):
+                continue
+            try:
+                pickle.dumps(constant)
+            except Exception:
+                continue
+            constants[name] = max(index[ref] for ref in closure if ref in index), closure, constant
+        return constants
+
+    def invalidate(self, name):
+        parallel.redefined()
+        stale = [name]
+        seen = {name}
+        while len(stale) > 0:
+            current = stale.pop()
+            func = self.functions.get(current)
+            if isinstance(func, Function):
+                func.table.constants.clear()
+                memo.invalidate(func.base)
+                if func.compiled is not None:
+                    compiler.prepare(func)
+            for dependent in self.dependents.get(current, ()):
+                if dependent not in seen:
+                    seen.add(dependent)
+                    stale.append(dependent)
+
+    def evaluate(self, expr):
+        try:
+            return value(expr, self.functions)
+        except RecursionError:
+            raise RuntimeError("Maximum recursion depth exceeded evaluating " + expr) from None
+
+    def write(self, expr, result):
+        if self.records is None:
+            print(expr, "=", result)
+        else:
+            self.records.write(json.dumps({"expr": expr, "value": plain(result)}) + "\n")
+            self.records.flush()
+
+    def say(self, text):
+        if self.log is not None:
+            print(text, file=self.log)
+        else:
+            print(text, file=sys.stdout if self.records is None else sys.stderr)
+
+    def read_input(self, name):
+        if name in self.defines:
+            return self.defines[name]
+        if self.records is None:
+            return input(name + ": ")
+        val = "" if self.inputs is None else self.inputs.readline()
+        if val == "":
+            raise RuntimeError("No value given for input " + name)
+        return val.strip()
 
     def run(self, action, data):
         if action == "output":
-            result = value(data, self.functions)
-            print(data, "=", result)
+            result = arrays.force(self.evaluate(data))
+            self.write(data, result)
             return True
         elif action == "input":
-            val = input(data + ": ")
-            self.functions[data] = value(val, self.functions)
+            val = self.read_input(data)
+            self.writable(data)
+            self.invalidate(data)
+            self.functions[data] = self.evaluate(val)
             return True
         elif action == "run":
-            with open(data, "r") as file:
-                code = file.readlines()
-            for line in code:
-                if not self.read_line(line):
-                    return False
+            return self.run_file(data)
+        elif action == "trace":
+            settings = data.split()
+            if len(settings) == 0 or len(settings) > 2:
+                raise RuntimeError("Expected trace: level [file], got " + data)
+            tracing.enable(*settings)
+            return True
+        elif action == "memo":
+            if data == "stats":
+                self.say(", ".join(key + " = " + str(val) for key, val in memo.stats().items()))
+            elif data == "clear":
+                memo.clear()
+            elif data in ("on", "off"):
+                memo.configure(on=data == "on")
+            else:
+                raise RuntimeError("Expected memo: stats|clear|on|off, got " + data)
+            return True
+        elif action == "fork":
+            if data not in ("on", "off"):
+                raise RuntimeError("Expected fork: on|off, got " + data)
+            self.functions.fork_join = data == "on"
+            return True
+        elif action == "profile":
+            profiler.start()
+            try:
+                result = arrays.force(self.evaluate(data))
+            finally:
+                profiler.stop()
+            self.write(data, result)
+            self.say(profiler.table())
+            return True
+        elif action == "flamegraph":
+            with open(data, "w") as file:
+                file.write(profiler.collapsed())
             return True
         elif action == "quit":
             return False
@@ -61,11 +314,109 @@ class Program:
             raise RuntimeError("Unknown action")
 
 
+def plain(val):
+    backend = arrays.owner(val)
+    if backend is not None:
+        return numpy.asarray(backend.from_device(val)).tolist()
+    if isinstance(val, numpy.generic):
+        return val.item()
+    if val is None or isinstance(val, (bool, int, float, str)):
+        return val
+    return str(val)
+
+
+def define(text):
+    name, sep, val = text.partition("=")
+    if sep == "" or name.strip() == "":
+        raise argparse.ArgumentTypeError("expected NAME=VALUE, got " + text)
+    return name.strip(), val.strip()
+
+
+def run_script(program, path):
+    if path != "-":
+        try:
+            program.run_file(path)
+        except OSError as error:
+            if program.location is None:
+                print(path + ": " + error.strerror, file=sys.stderr)
+                return 2
+            print(program.location[0] + ":" + str(program.location[1]) + ": " + str(error), file=sys.stderr)
+            return 1
+        except Exception as error:
+            if program.location is None:
+                print(path + ": " + str(error), file=sys.stderr)
+                return 2
+            print(program.location[0] + ":" + str(program.location[1]) + ": " + str(error), file=sys.stderr)
+            return 1
+        finally:
+            tracing.flush()
+        return 0
+    for number, line in enumerate(sys.stdin, 1):
+        try:
+            if not program.read_line(line):
+                break
+        except Exception as error:
+            print(path + ":" + str(number) + ": " + str(error), file=sys.stderr)
+            return 1
+        finally:
+            tracing.flush()
+    return 0
+
+
+def repl(program):
+    try:
+        while True:
+            try:
+                line_in = input("> ")
+            except EOFError:
+                return 0
+            if not program.read_line(line_in):
+                return 0
+            tracing.flush()
+    finally:
+        program.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("script", nargs="?", help="run this file (- for stdin) and exit instead of starting the REPL")
+    parser.add_argument("--define", type=define, action="append", default=[], metavar="NAME=VALUE",
+                        help="value for input: NAME (otherwise read from stdin, one line per input)")
+    parser.add_argument("--backend", choices=backends, default="interpreted")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write " + cache.directory)
+    parser.add_argument("--device", choices=["auto"] + sorted(arrays.registry), default="auto")
+    parser.add_argument("--trace", choices=sorted(tracing.levels), default="off")
+    parser.add_argument("--trace-file", default=tracing.default_file)
+    parser.add_argument("--max-depth", type=int, default=max_depth, help="maximum depth of nested function calls")
+    parser.add_argument("--lazy", action="store_true", help="pass arguments as shared thunks (call-by-need)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes used by map on large arrays (0 = serial, -1 = one per core)")
+    parser.add_argument("--parallel-threshold", type=int, default=parallel.threshold)
+    parser.add_argument("--fork-join", action="store_true",
+                        help="evaluate independent call arguments in the worker pool")
+    parser.add_argument("--fork-depth", type=int, help="levels of nested calls that may fork")
+    parser.add_argument("--no-memo", action="store_true")
+    parser.add_argument("--memo-entries", type=int, default=memo.max_entries)
+    parser.add_argument("--memo-bytes", type=int, default=memo.max_bytes)
+    options = parser.parse_args()
+    tracing.enable(options.trace, options.trace_file)
+    set_max_depth(options.max_depth)
+    set_call_by_need(options.lazy)
+    if options.fork_join and options.workers == 0:
+        options.workers = -1
+    parallel.configure(options.workers, options.parallel_threshold, options.fork_depth)
+    arrays.select(options.device)
+    memo.configure(options.memo_entries, options.memo_bytes, not options.no_memo)
+    cache.enabled = not options.no_cache
+    if options.script is None:
+        return repl(Program(options.backend, options.fork_join, dict(options.define)))
+    inputs = None if options.script == "-" else sys.stdin
+    program = Program(options.backend, options.fork_join, dict(options.define), inputs, sys.stdout)
+    try:
+        return run_script(program, options.script)
+    finally:
+        program.close()
+
+
 if __name__ == "__main__":
-    if enable_log:
-        with open(log_file, "w") as file:
-            file.write("")
-    program = Program()
-    line_in = input("> ")
-    while program.read_line(line_in):
-        line_in = input("> ")
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy
+
+
+enabled = True
+max_entries = 100000
+max_bytes = 256 * 2 ** 20
+
+missing = object()
+lock = threading.RLock()
+table = OrderedDict()
+keys_by_func = {}
+sizes = {}
+digests = {}
+size = 0
+hits = 0
+misses = 0
+
+
+def configure(entries=None, budget=None, on=None):
+    global max_entries, max_bytes, enabled
+    if entries is not None:
+        max_entries = entries
+    if budget is not None:
+        max_bytes = budget
+    if on is not None:
+        enabled = on
+        if not on:
+            clear()
+    evict()
+
+
+def arg_key(arg):
+    if isinstance(arg, numpy.memmap) and arg.filename is not None:
+        address = arg.__array_interface__["data"][0]
+        return "memmap", arg.filename, os.path.getmtime(arg.filename), address, arg.dtype.str, arg.shape, arg.strides
+    if isinstance(arg, numpy.ndarray):
+        if arg.dtype.hasobject:
+            return None
+        return "array", arg.dtype.str, arg.shape, array_digest(arg)
+    if isinstance(arg, numpy.generic):
+        return "scalar", arg.dtype.str, arg.item()
+    if isinstance(arg, (int, float, str)):
+        return type(arg).__name__, arg
+    return None
+
+
+def array_digest(arr):
+    entry = digests.get(id(arr))
+    if entry is not None and entry[0]() is arr:
+        return entry[1]
+    digest = hashlib.blake2b(numpy.ascontiguousarray(arr), digest_size=16).digest()
+    ref = weakref.ref(arr, lambda ref, key=id(arr): forget(key, ref))
+    digests[id(arr)] = ref, digest
+    return digest
+
+
+def forget(key, ref):
+    entry = digests.get(key)
+    if entry is not None and entry[0] is ref:
+        del digests[key]
+
+
+def make_key(func, args):
+    key = [func]
+    for arg in args:
+        part = arg_key(arg)
+        if part is None:
+            return None
+        key.append(part)
+    return tuple(key)
+
+
+def result_size(result):
+    if isinstance(result, numpy.ndarray):
+        return result.nbytes + 128
+    return sys.getsizeof(result) + 128
+
+
+def get(key):
+    global hits, misses
+    with lock:
+        result = table.get(key, missing)
+        if result is missing:
+            misses += 1
+        else:
+            hits += 1
+            table.move_to_end(key)
+    return result
+
+
+def put(key, result):
+    global size
+    result_bytes = result_size(result)
+    if result_bytes > max_bytes or max_entries == 0:
+        return
+    with lock:
+        if key in table:
+            remove(key)
+        table[key] = result
+        sizes[key] = result_bytes
+        size += result_bytes
+        keys_by_func.setdefault(key[0], set()).add(key)
+        evict()
+
+
+def remove(key):
+    global size
+    del table[key]
+    size -= sizes.pop(key)
+    keys = keys_by_func[key[0]]
+    keys.discard(key)
+    if len(keys) == 0:
+        del keys_by_func[key[0]]
+
+
+def evict():
+    while len(table) > 0 and (len(table) > max_entries or size > max_bytes):
+        remove(next(iter(table)))
+
+
+def invalidate(func):
+    with lock:
+        for key in list(keys_by_func.get(func, ())):
+            remove(key)
+
+
+def clear():
+    global size
+    with lock:
+        table.clear()
+        keys_by_func.clear()
+        sizes.clear()
+        size = 0
+
+
+def stats():
+    return {"entries": len(table), "bytes": size, "hits": hits, "misses": misses}
@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import arrays
+import core
+import profiler
+import tracing
+from core import Function, Apply, Name, Scope, value, force, global_scope
+
+
+workers = 0
+threshold = 10000
+chunks_per_worker = 4
+fork_depth = 1
+
+pool = None
+shipped = None
+generation = 0
+pool_lock = threading.Lock()
+worker_scope = None
+local = threading.local()
+
+
+def configure(count=None, min_size=None, depth=None):
+    global workers, threshold, fork_depth
+    if count is not None:
+        workers = (os.cpu_count() or 1) if count < 0 else count
+        fork_depth = (workers - 1).bit_length() + 2
+        shutdown()
+    if min_size is not None:
+        threshold = min_size
+    if depth is not None:
+        fork_depth = depth
+    core.set_fork(fork_args if workers > 1 else None)
+
+
+def context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def redefined():
+    global generation
+    generation += 1
+
+
+def shutdown():
+    global pool, shipped
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+    pool = None
+    shipped = None
+
+
+def start_worker(payload, compiled, depth, lazy):
+    global worker_scope, workers
+    workers = 0
+    core.set_fork(None)
+    core.set_max_depth(depth)
+    core.set_call_by_need(lazy)
+    worker_scope = pickle.loads(payload)
+    if compiled:
+        import compiler
+        for func in worker_scope.values():
+            if isinstance(func, Function) and compiler.compilable(func):
+                compiler.prepare(func)
+
+
+def run_chunk(func, chunk):
+    if isinstance(func, str):
+        func = worker_scope[func]
+    return numpy.array([arrays.force(func.evaluate([chunk[i]], worker_scope)) for i in range(len(chunk))])
+
+
+def run_node(node, bindings):
+    return arrays.force(value(node, Scope(bindings, parent=worker_scope, local=True)))
+
+
+def usable(arr):
+    return workers > 1 and isinstance(arr, numpy.ndarray) and arr.ndim > 0 and len(arr) >= threshold
+
+
+def get_pool(scope):
+    global pool, shipped
+    with pool_lock:
+        if pool is None or shipped[0] is not scope or shipped[1] != generation:
+            payload = pickle.dumps(scope)
+            shutdown()
+            compiled = any(isinstance(func, Function) and func.compiled is not None for func in scope.values())
+            pool = ProcessPoolExecutor(workers, mp_context=context(), initializer=start_worker,
+                                       initargs=(payload, compiled, core.max_depth, core.call_by_need))
+            shipped = scope, generation
+        return pool
+
+
+def map_array(func, arr, namespace):
+    scope = global_scope(namespace)
+    try:
+        executor = get_pool(scope)
+        task = func.name if scope.get(func.name) is func else func
+        pickle.dumps(task)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    size = max(1, -(-len(arr) // (workers * chunks_per_worker)))
+    futures = [executor.submit(run_chunk, task, arr[i:i + size]) for i in range(0, len(arr), size)]
+    return numpy.concatenate([future.result() for future in futures])
+
+
+def heavy(node, namespace):
+    if not isinstance(node, Apply) or not isinstance(node.func, Name):
+        return False
+    func = namespace.get(node.func.name)
+    return isinstance(func, Function) and any(body is not None for body in func.defs)
+
+
+def fork_args(nodes, namespace):
+    scope = global_scope(namespace)
+    depth = getattr(local, "depth", 0)
+    if not scope.fork_join or depth >= fork_depth or profiler.enabled or tracing.enabled:
+        return None
+    forked = [i for i in range(len(nodes)) if heavy(nodes[i], namespace)]
+    if len(forked) < 2:
+        return None
+    if depth == fork_depth - 1:
+        return submit(nodes, forked, namespace, scope)
+    return spawn(nodes, forked, namespace, depth + 1)
+
+
+def submit(nodes, forked, namespace, scope):
+    bindings = {}
+    if namespace is not scope:
+        bindings = {key: force(val) for key, val in dict.items(namespace)}
+    try:
+        executor = get_pool(scope)
+        pickle.dumps(bindings)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    futures = {i: executor.submit(run_node, nodes[i], bindings) for i in forked}
+    args = [None] * len(nodes)
+    for i in range(len(nodes)):
+        if i not in futures:
+            args[i] = value(nodes[i], namespace)
+    for i, future in futures.items():
+        args[i] = future.result()
+    return args
+
+
+def spawn(nodes, forked, namespace, depth):
+    args = [None] * len(nodes)
+    errors = []
+
+    def branch(i):
+        local.depth = depth
+        try:
+            args[i] = value(nodes[i], namespace)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=branch, args=(i,)) for i in forked[1:]]
+    for thread in threads:
+        thread.start()
+    outer = depth - 1
+    try:
+        branch(forked[0])
+        for i in range(len(nodes)):
+            if i not in forked:
+                args[i] = value(nodes[i], namespace)
+    finally:
+        local.depth = outer
+        for thread in threads:
+            thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return args
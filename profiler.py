@@ -0,0 +1,97 @@
+import time
+
+
+enabled = False
+stats = {}
+stacks = {}
+frames = []
+active = {}
+
+
+class Entry:
+    __slots__ = ("calls", "partials", "failures", "inclusive", "exclusive")
+
+    def __init__(self):
+        self.calls = 0
+        self.partials = 0
+        self.failures = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+
+
+class Frame:
+    __slots__ = ("name", "path", "start", "children")
+
+    def __init__(self, name, path, start):
+        self.name = name
+        self.path = path
+        self.start = start
+        self.children = 0.0
+
+
+def start():
+    global enabled
+    stats.clear()
+    stacks.clear()
+    frames.clear()
+    active.clear()
+    enabled = True
+
+
+def stop():
+    global enabled
+    enabled = False
+    while len(frames) > 0:
+        leave()
+
+
+def entry(name):
+    if name not in stats:
+        stats[name] = Entry()
+    return stats[name]
+
+
+def enter(name):
+    entry(name).calls += 1
+    if len(frames) > 0:
+        path = frames[-1].path + ";" + name
+    else:
+        path = name
+    frames.append(Frame(name, path, time.perf_counter()))
+    active[name] = active.get(name, 0) + 1
+
+
+def leave(partial=False, failed=False):
+    now = time.perf_counter()
+    frame = frames.pop()
+    record = entry(frame.name)
+    elapsed = now - frame.start
+    record.exclusive += elapsed - frame.children
+    active[frame.name] -= 1
+    if active[frame.name] == 0:
+        record.inclusive += elapsed
+    if partial:
+        record.partials += 1
+    if failed:
+        record.failures += 1
+    stacks[frame.path] = stacks.get(frame.path, 0.0) + elapsed - frame.children
+    if len(frames) > 0:
+        frames[-1].children += elapsed
+
+
+def switch(name):
+    leave()
+    enter(name)
+
+
+def table():
+    lines = ["{:<20} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        "function", "calls", "partials", "failures", "inclusive", "exclusive")]
+    for name, record in sorted(stats.items(), key=lambda item: item[1].exclusive, reverse=True):
+        lines.append("{:<20} {:>10} {:>10} {:>10} {:>11.6f}s {:>11.6f}s".format(
+            name, record.calls, record.partials, record.failures, record.inclusive, record.exclusive))
+    return "\n".join(lines)
+
+
+def collapsed():
+    return "".join(path + " " + str(int(seconds * 1e6)) + "\n" for path, seconds in stacks.items())
@@ -0,0 +1,40 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+
+def run(directory, backend):
+    command = [sys.executable, os.path.join(root, "main.py"), "--no-cache", "--backend", backend, "backends.shr"]
+    return subprocess.run(command, cwd=directory, capture_output=True, text=True, timeout=30)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(os.path.join(here, "backends.shr"), directory)
+        numpy.arange(3, dtype=numpy.uint8).tofile(os.path.join(directory, "small.u8"))
+        try:
+            interpreted = run(directory, "interpreted")
+            compiled = run(directory, "compiled")
+        except subprocess.TimeoutExpired as error:
+            print("timed out: " + " ".join(error.cmd), file=sys.stderr)
+            return 1
+    if interpreted.returncode != 0 or compiled.returncode != 0:
+        print(interpreted.stderr + compiled.stderr, end="", file=sys.stderr)
+        return 1
+    if interpreted.stdout != compiled.stdout:
+        print("interpreted:\n" + interpreted.stdout + "compiled:\n" + compiled.stdout, file=sys.stderr)
+        return 1
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script = "a = 5\noutput: a\ninput: a\noutput: a\nf x = add x 1\ninput: f\noutput: f\n"
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rebind.shr")
+        with open(path, "w") as file:
+            file.write(script)
+        for extra in ([], [], ["--no-cache"]):
+            run = subprocess.run([sys.executable, os.path.join(root, "main.py"), *extra, "--define", "a=7",
+                                  "--define", "f=3", path], capture_output=True, text=True)
+            if run.returncode != 0:
+                print(run.stderr, end="", file=sys.stderr)
+                return 1
+            if run.stdout.splitlines() != ['{"expr": "a", "value": 5}', '{"expr": "a", "value": 7}', '{"expr": "f", "value": 3}']:
+                print("unexpected output: " + run.stdout, file=sys.stderr)
+                return 1
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import arrays
+import cache
+import memo
+from core import Function, set_max_depth, set_interrupt, max_depth
+from main import Program, backends
+
+
+timeout = 30.0
+stack_size = 256 * 2 ** 20
+cancel_command = "cancel"
+blocked = {"trace", "profile", "flamegraph"}
+local = threading.local()
+
+
+class Token:
+    __slots__ = ("reason",)
+
+    def __init__(self):
+        self.reason = None
+
+
+def check():
+    token = getattr(local, "token", None)
+    if token is not None and token.reason is not None:
+        raise RuntimeError(token.reason)
+
+
+def status(ok, error=None):
+    if ok:
+        return json.dumps({"ok": True}) + "\n"
+    return json.dumps({"ok": False, "error": error}) + "\n"
+
+
+def execute(program, line, token):
+    local.token = token
+    program.records = io.StringIO()
+    program.log = io.StringIO()
+    running = True
+    try:
+        check()
+        op = program.translate(line)
+        if op is not None:
+            if op[0] == "action" and (op[1] in blocked or op[1] == "memo" and op[2] != "stats"):
+                raise RuntimeError(op[1] + ": is not available in server mode")
+            running = program.execute(op)
+        result = status(True)
+    except RecursionError:
+        result = status(False, "Maximum recursion depth exceeded")
+    except Exception as error:
+        result = status(False, str(error))
+    finally:
+        local.token = None
+    messages = "".join(json.dumps({"message": text}) + "\n" for text in program.log.getvalue().splitlines())
+    return running, program.records.getvalue() + messages + result
+
+
+class Server:
+    def __init__(self, library, backend="interpreted", workers=4, limit=timeout):
+        self.library = library
+        self.backend = backend
+        self.timeout = limit
+        self.executor = ThreadPoolExecutor(workers)
+
+    def open_session(self):
+        return Program(self.backend, inputs=None, records=io.StringIO(), library=self.library)
+
+    def close_session(self, program):
+        program.close()
+        for func in dict.values(program.functions):
+            if isinstance(func, Function):
+                memo.invalidate(func.base)
+
+    async def session(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        program = self.open_session()
+        lines = asyncio.Queue()
+        current = [None]
+
+        async def receive():
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                text = line.decode()
+                if text.strip() == cancel_command:
+                    if current[0] is not None:
+                        current[0].reason = "Evaluation cancelled"
+                    continue
+                await lines.put(text)
+            if current[0] is not None:
+                current[0].reason = "Client disconnected"
+            await lines.put(None)
+
+        receiver = asyncio.ensure_future(receive())
+        try:
+            while True:
+                text = await lines.get()
+                if text is None:
+                    break
+                token = Token()
+                current[0] = token
+                job = loop.run_in_executor(self.executor, execute, program, text, token)
+                try:
+                    running, response = await asyncio.wait_for(asyncio.shield(job), self.timeout)
+                except asyncio.TimeoutError:
+                    token.reason = "Evaluation timed out after " + str(self.timeout) + "s"
+                    await job
+                    running, response = True, status(False, token.reason)
+                current[0] = None
+                writer.write(response.encode())
+                await writer.drain()
+                if not running:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            receiver.cancel()
+            self.close_session(program)
+            writer.close()
+
+    async def serve(self, socket_path=None, host="127.0.0.1", port=7878):
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.session, path=socket_path)
+            print("Serving on " + socket_path, file=sys.stderr)
+        else:
+            server = await asyncio.start_server(self.session, host, port)
+            print("Serving on " + host + ":" + str(port), file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def load_library(paths, backend):
+    library = Program(backend)
+    for path in paths:
+        library.run_file(path)
+    library.close()
+    return library
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the line protocol of main.py to many clients.")
+    parser.add_argument("--socket", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7878)
+    parser.add_argument("--library", action="append", default=[], metavar="FILE",
+                        help="script loaded once and shared read-only by every session")
+    parser.add_argument("--backend", choices=backends, default="interpreted")
+    parser.add_argument("--device", choices=["auto"] + sorted(arrays.registry), default="auto")
+    parser.add_argument("--workers", type=int, default=4, help="evaluations that may run at the same time")
+    parser.add_argument("--timeout", type=float, default=timeout, help="seconds allowed per request")
+    parser.add_argument("--max-depth", type=int, default=max_depth, help="maximum depth of nested function calls")
+    parser.add_argument("--no-cache", action="store_true")
+    options = parser.parse_args()
+    set_max_depth(options.max_depth)
+    arrays.select(options.device)
+    cache.enabled = not options.no_cache
+    threading.stack_size(stack_size)
+    library = load_library(options.library, options.backend)
+    set_interrupt(check)
+    server = Server(library, options.backend, options.workers, options.timeout)
+    try:
+        asyncio.run(server.serve(options.socket, options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import atexit
+
+
+OFF = 0
+CALLS = 1
+VALUES = 2
+levels = {"off": OFF, "calls": CALLS, "values": VALUES}
+
+default_file = "log.txt"
+
+enabled = False
+level = OFF
+sink = None
+indent = 0
+
+
+class BufferedSink:
+    def __init__(self, file_name, buffer_size=4096):
+        self.file = open(file_name, "w")
+        self.buffer_size = buffer_size
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.records) == 0:
+            return
+        self.file.write("".join(render(record) for record in self.records))
+        self.file.flush()
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def render(record):
+    depth, message, args = record
+    return "  " * depth + message.format(*args) + "\n"
+
+
+def enable(level_name, file_name=None):
+    global enabled, level, sink, indent
+    if level_name not in levels:
+        raise RuntimeError("Unknown trace level " + level_name)
+    if levels[level_name] == OFF:
+        disable()
+        return
+    if sink is not None and file_name is not None:
+        sink.close()
+        sink = None
+    if sink is None:
+        sink = BufferedSink(default_file if file_name is None else file_name)
+    level = levels[level_name]
+    indent = 0
+    enabled = True
+
+
+def disable():
+    global enabled, level, sink
+    enabled = False
+    level = OFF
+    if sink is not None:
+        sink.close()
+        sink = None
+
+
+def flush():
+    if sink is not None:
+        sink.flush()
+
+
+def emit(record_level, message, args, ind_inc=0):
+    global indent
+    if record_level <= level:
+        sink.write((indent, message, args))
+        indent += ind_inc
+
+
+atexit.register(disable)